@@ -1,19 +1,78 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
-from functools import lru_cache
+from functools import cached_property
 from glob import iglob
-from os import listdir
-from os.path import isdir, isfile, join
+from os import scandir
+from os.path import isdir, join
 from pathlib import Path
-from re import search, sub
+import re
 
 import numpy as np
 
-from npstreams import average
 from skued import diffread
 
 from iris import AbstractRawDataset, check_raw_bounds
 
+try:
+    from tifffile import memmap as tiff_memmap
+except ImportError:
+    tiff_memmap = None
+
+# Patterns used to parse directory names, image filenames and tagfiles
+DATE_PATTERN = re.compile(r"(\d+[.])+")
+NSCAN_PATTERN = re.compile(r"nscan[.](\d+)")
+TIME_PATTERN = re.compile(r"[+-]\d+[.]\d+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def read_mapped(fname):
+    """ 
+    Read the image ``fname``. Uncompressed TIFF files are memory-mapped 
+    read-only if tifffile is available; other files are read with ``diffread``.
+    """
+    if tiff_memmap is not None:
+        with suppress(ValueError):
+            return tiff_memmap(fname, mode="r")
+    return diffread(fname)
+
+
+def average_images(fnames):
+    """ 
+    Average of the images ``fnames``, accumulated in single precision. 
+    
+    Images are read in parallel threads while they are being accumulated.
+
+    Raises
+    ------
+    IOError : if ``fnames`` is empty.
+    """
+    fnames = list(fnames)
+    if not fnames:
+        raise IOError("Expected background images to exist, but could not find any.")
+
+    with ThreadPoolExecutor() as executor:
+        images = executor.map(diffread, fnames)
+        accumulator = np.array(next(images), dtype=np.float32)
+        for image in images:
+            accumulator += image
+    accumulator /= len(fnames)
+    return accumulator
+
+
+def subtract_clip(im, bg, rows=32):
+    """ 
+    Subtract ``bg`` from ``im`` in-place and clip negative values to zero. 
+    
+    The image is processed a block of ``rows`` rows at a time, so that both the
+    subtraction and the clipping operate on a block while it is still in cache. 
+    """
+    for start in range(0, im.shape[0], rows):
+        block = im[start : start + rows]
+        np.subtract(block, bg[start : start + rows], out=block)
+        np.maximum(block, 0, out=block)
+    return im
+
 
 class McGillRawDatasetAlpha(AbstractRawDataset):
     """
@@ -50,35 +109,26 @@ class McGillRawDatasetAlpha(AbstractRawDataset):
         # If directory name doesn't match the time pattern, the
         # acquisition date will be the default value
         with suppress(AttributeError):
-            self.acquisition_date = search(r"(\d+[.])+", str(self.source)).group()[
+            self.acquisition_date = DATE_PATTERN.search(str(self.source)).group()[
                 :-1
             ]  # Last [:-1] removes a '.' at the end
 
-        # To determine the scans and time-points, we need a list of all files
-        image_list = [
-            f
-            for f in listdir(self.source)
-            if isfile(join(self.source, f)) and f.endswith((".tif", ".tiff"))
-        ]
-
-        # Determine the number of scans
-        # by listing all possible files
-        scans = [
-            search("[n][s][c][a][n][.](\d+)", f).group()
-            for f in image_list
-            if "nscan" in f
-        ]
-        self.scans = tuple({int(string.strip("nscan.")) for string in scans})
-
-        # Determine the time-points by listing all possible files
-        time_data = [
-            search("[+-]\d+[.]\d+", f).group() for f in image_list if "timedelay" in f
-        ]
-        time_list = list(
-            set(time_data)
-        )  # Conversion to set then back to list to remove repeated values
-        time_list.sort(key=float)
-        self.time_points = tuple(map(float, time_list))
+        # Determine the scans and time-points in a single pass
+        # over all images in the directory
+        scans, time_points = set(), set()
+        with scandir(self.source) as entries:
+            for entry in entries:
+                name = entry.name
+                if not (name.endswith((".tif", ".tiff")) and entry.is_file()):
+                    continue
+
+                if "nscan" in name:
+                    scans.add(int(NSCAN_PATTERN.search(name).group(1)))
+                if "timedelay" in name:
+                    time_points.add(float(TIME_PATTERN.search(name).group()))
+
+        self.scans = tuple(sorted(scans))
+        self.time_points = tuple(sorted(time_points))
 
     @staticmethod
     def parse_tagfile(path):
@@ -86,7 +136,7 @@ class McGillRawDatasetAlpha(AbstractRawDataset):
         metadata = dict()
         with open(path) as f:
             for line in f:
-                key, value = sub("\s+", "", line).split(
+                key, value = WHITESPACE_PATTERN.sub("", line).split(
                     "="
                 )  # \s+ means all white space , including 'unicode' white space
                 try:
@@ -98,12 +148,10 @@ class McGillRawDatasetAlpha(AbstractRawDataset):
                 metadata[key.lower()] = value
         return metadata
 
-    @property
-    @lru_cache(maxsize=1)
+    @cached_property
     def background(self):
         """ Laser background """
-        backgrounds = map(diffread, iglob(join(self.source, "background.*.pumpon.tif")))
-        return average(backgrounds)
+        return average_images(iglob(join(self.source, "background.*.pumpon.tif")))
 
     @check_raw_bounds
     def raw_data(self, timedelay, scan=1, bgr=True, **kwargs):
@@ -140,10 +188,9 @@ class McGillRawDatasetAlpha(AbstractRawDataset):
             + ".pumpon.tif"
         )
 
-        im = diffread(join(self.source, filename)).astype(np.float)
+        im = np.array(read_mapped(join(self.source, filename)), dtype=np.float32)
         if bgr:
-            im -= self.background
-            im[im < 0] = 0
+            subtract_clip(im, self.background)
 
         return im
 
@@ -170,12 +217,10 @@ class McGillRawDatasetAlphaPumpoff(AbstractRawDataset):
             self.scans=[1]
             self.time_points = list(dset.scans)
         
-    @property
-    @lru_cache(maxsize=1)
+    @cached_property
     def background(self):
         """ Laser background """
-        backgrounds = map(diffread, iglob(join(self.source, "background.*.pumpoff.tif")))
-        return average(backgrounds)
+        return average_images(iglob(join(self.source, "background.*.pumpoff.tif")))
 
     def raw_data(self, timedelay, scan=1, bgr=True, **kwargs):
         """
@@ -205,9 +250,8 @@ class McGillRawDatasetAlphaPumpoff(AbstractRawDataset):
                 f"Expected the file {fname} to exist, but could not find it."
             )
         
-        im = np.asfarray(diffread(fname))
+        im = np.array(read_mapped(fname), dtype=np.float32)
         if bgr:
-            im -= self.background
-            im[im < 0] = 0
+            subtract_clip(im, self.background)
 
         return im
\ No newline at end of file
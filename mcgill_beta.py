@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
+from ast import literal_eval
 from configparser import ConfigParser
-from glob import iglob
-from os.path import isdir, join
+from contextlib import suppress
+from functools import lru_cache
+from os import scandir
+from os.path import abspath, getmtime, isdir, join
 from pathlib import Path
+import re
 
 import numpy as np
 
@@ -10,6 +14,56 @@ from skued import diffread
 
 from iris import AbstractRawDataset, check_raw_bounds
 
+try:
+    from tifffile import memmap as tiff_memmap
+except ImportError:
+    tiff_memmap = None
+
+# Pump-on filenames look like 'pumpon_+00001.500ps_<timestamp>.tif'
+PUMPON_PATTERN = re.compile(r"pumpon_([+-]\d+\.\d{3})ps_.*\.tif")
+
+
+def read_mapped(fname):
+    """ 
+    Read the image ``fname``. Uncompressed TIFF files are memory-mapped 
+    read-only if tifffile is available; other files are read with ``diffread``.
+    """
+    if tiff_memmap is not None:
+        with suppress(ValueError):
+            return tiff_memmap(fname, mode="r")
+    return diffread(fname)
+
+
+@lru_cache(maxsize=32)
+def read_metadata(fname, mtime):
+    """ 
+    Translate metadata from the config file ``fname`` into Iris's metadata format.
+    Results are cached; the modification time ``mtime`` is part of the cache key 
+    so that a modified file is parsed again.
+    """
+    metadata = dict()
+
+    parser = ConfigParser(inline_comment_prefixes=("#"))
+    parser.read(fname)
+    exp_params = parser["EXPERIMENTAL PARAMETERS"]
+
+    # Translation is required between metadata formats
+    metadata["energy"] = exp_params["electron energy"]
+    metadata["acquisition_date"] = exp_params["acquisition date"]
+    metadata["fluence"] = exp_params["fluence"]
+    metadata["temperature"] = exp_params["temperature"]
+    metadata["exposure"] = exp_params["exposure"]
+    metadata["notes"] = exp_params["notes"]
+    metadata["pump_wavelength"] = exp_params["pump wavelength"]
+
+    metadata["scans"] = tuple(range(1, int(exp_params["nscans"]) + 1))
+    metadata["time_points"] = np.asarray(
+        literal_eval(exp_params["time points"]), dtype=np.float64
+    )
+    metadata["time_points"].setflags(write=False)
+
+    return metadata
+
 
 class McGillRawDatasetBeta(AbstractRawDataset):
     """
@@ -35,6 +89,9 @@ class McGillRawDatasetBeta(AbstractRawDataset):
         metadata_dict = self.parse_metadata(join(source, "metadata.cfg"))
         super().__init__(source, metadata_dict)
 
+        # Directory listings of each scan, built on first access
+        self._scan_indices = dict()
+
     def parse_metadata(self, fname):
         """ 
         Translate metadata from experiment into Iris's metadata format. 
@@ -44,25 +101,30 @@ class McGillRawDatasetBeta(AbstractRawDataset):
         fname : str or path-like
             Filename to the config file.
         """
-        metadata = dict()
-
-        parser = ConfigParser(inline_comment_prefixes=("#"))
-        parser.read(fname)
-        exp_params = parser["EXPERIMENTAL PARAMETERS"]
+        fname = abspath(fname)
+        # The cached dictionary is shared, hence the copy
+        return dict(read_metadata(fname, getmtime(fname)))
 
-        # Translation is required between metadata formats
-        metadata["energy"] = exp_params["electron energy"]
-        metadata["acquisition_date"] = exp_params["acquisition date"]
-        metadata["fluence"] = exp_params["fluence"]
-        metadata["temperature"] = exp_params["temperature"]
-        metadata["exposure"] = exp_params["exposure"]
-        metadata["notes"] = exp_params["notes"]
-        metadata["pump_wavelength"] = exp_params["pump wavelength"]
+    def _scan_index(self, scan):
+        """ 
+        Pump-on images of scan ``scan``, as a dictionary mapping the formatted
+        time-delay (e.g. '+00001.500') to the image filename. The scan directory 
+        is only listed the first time.
+        """
+        with suppress(KeyError):
+            return self._scan_indices[scan]
 
-        metadata["scans"] = list(range(1, int(exp_params["nscans"]) + 1))
-        metadata["time_points"] = eval(exp_params["time points"])
+        # scan directory looks like 'scan 0132'
+        index = dict()
+        with suppress(FileNotFoundError):
+            with scandir(join(self.source, f"scan {scan:04d}")) as entries:
+                for entry in entries:
+                    match = PUMPON_PATTERN.fullmatch(entry.name)
+                    if match:
+                        index[match.group(1)] = entry.path
 
-        return metadata
+        self._scan_indices[scan] = index
+        return index
 
     @check_raw_bounds
     def raw_data(self, timedelay, scan=1, **kwargs):
@@ -82,21 +144,20 @@ class McGillRawDatasetBeta(AbstractRawDataset):
         Returns
         -------
         arr : `~numpy.ndarray`, ndim 2
+            Image; this may be a read-only memory map of the file.
         
         Raises
         ------
         ValueError : if ``timedelay`` or ``scan`` are invalid / out of bounds.
         IOError : Filename is not associated with an image/does not exist.
         """
-        # scan directory looks like 'scan 0132'
-        # Note that a glob pattern is required because every diffraction pattern
-        # has a timestamp in the filename.
-        directory = join(self.source, f"scan {scan:04d}")
+        # Note that filenames cannot be formatted directly because every diffraction
+        # pattern has a timestamp in the filename.
         try:
-            fname = next(iglob(join(directory, f"pumpon_{timedelay:+010.3f}ps_*.tif")))
-        except StopIteration:
+            fname = self._scan_index(scan)[f"{timedelay:+010.3f}"]
+        except KeyError:
             raise IOError(
                 f"Expected the file for {timedelay}ps and scan {scan} to exist, but could not find it."
             )
 
-        return diffread(fname)
+        return read_mapped(fname)
@@ -1,43 +1,122 @@
 # -*- coding: utf-8 -*-
 
-import csv
+from ast import literal_eval
+from collections import namedtuple
 from configparser import ConfigParser
+from contextlib import suppress
+from functools import lru_cache
 from operator import itemgetter
-from functools import wraps
 import os
 import numpy as np
 from npstreams import average
 from iris import AbstractRawDataset, check_raw_bounds
 from skued import diffread
 
+try:
+    from tifffile import memmap as tiff_memmap
+except ImportError:
+    tiff_memmap = None
+
+# Directories of background images, which are also their categories
+LASER_BACKGROUND = "laser_background"
+PUMP_OFF = "pump_off"
+DARK_IMAGE = "dark_image"
+
+# Key-value store held as parallel arrays: ``names`` are absolute filepaths,
+# ``values`` are floats, and ``index`` maps a name to its position in both arrays
+KVStore = namedtuple("KVStore", ["names", "values", "index"])
+
     
 def csv_to_kvstore(sname, fname):
-    """ Parse CSV file into key-value store where keys are 
+    """ Parse CSV file into a KVStore where keys are 
     always fileos.abspaths, and values are always floats """
-    ffname = os.path.join(sname , fname)
-    with open(ffname, mode="r") as f:
-        reader = csv.reader(f)
-        next(reader, None)  # Skip one row of headers
-        dictdata={}
-        for row in reader:
-            key = os.path.join(sname, row[0]).replace('\\','/')
-            dictdata[key] = float(row[1])
-        return dictdata#{os.path.abspath(row[0]): float(row[1]) for row in reader}
-
+    table = np.loadtxt(
+        os.path.join(sname , fname),
+        delimiter=",",
+        skiprows=1,  # Skip one row of headers
+        dtype=[("name", "U256"), ("value", np.float64)],
+        ndmin=1,
+    )
+    # Keys are joined to the source directory and use forward slashes only
+    prefix = sname.replace('\\','/').rstrip('/') + '/'
+    names = np.char.add(prefix, np.char.replace(table["name"], '\\','/'))
+    return KVStore(
+        names=names,
+        values=np.ascontiguousarray(table["value"]),
+        index={k: i for i, k in enumerate(names.tolist())},
+    )
+
+
+def read_mapped(fname):
+    """ 
+    Read the image ``fname``. Uncompressed TIFF files are memory-mapped 
+    read-only if tifffile is available; other files are read with ``diffread``.
+    """
+    if tiff_memmap is not None:
+        with suppress(ValueError):
+            return tiff_memmap(fname, mode="r")
+    return diffread(fname)
 
-def asfarray(f):
-    """ Cast the result array from a function as a floating-point array """
 
-    @wraps(f)
-    def newf(*args, **kwargs):
-        return np.asfarray(f(*args, **kwargs))
+def nearest_index(sorted_values, values):
+    """ 
+    Index of the element of ``sorted_values`` nearest to each of ``values``, 
+    found by binary search. Ties are resolved in favour of the smaller element.
+    """
+    right = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    left = np.maximum(right - 1, 0)
+    closer_left = values - sorted_values[left] <= sorted_values[right] - values
+    return np.where(closer_left, left, right)
+
+
+@lru_cache(maxsize=32)
+def cached_read(fname):
+    """ 
+    Read the image ``fname`` as a read-only array of its native dtype, memory-mapped 
+    if possible. Results are cached because the same background image is subtracted 
+    from many frames.
+    """
+    im = read_mapped(fname)
+    im.setflags(write=False)
+    return im
 
-    return newf
 
 def newgetitem(self, key):
     key = str(key)
     return dict.__getitem__(self, key)
-    
+
+
+@lru_cache(maxsize=32)
+def read_metadata(fname, mtime):
+    """ 
+    Translate metadata from the config file ``fname`` into Iris's metadata format.
+    Results are cached; the modification time ``mtime`` is part of the cache key 
+    so that a modified file is parsed again.
+    """
+    metadata = dict()
+
+    parser = ConfigParser(inline_comment_prefixes=("#"))
+    parser.read(fname)
+    exp_params = parser["EXPERIMENTAL PARAMETERS"]
+
+    # Translation is required between metadata formats
+    metadata["energy"] = exp_params["electron energy"]
+    metadata["acquisition_date"] = exp_params["acquisition date"]
+    metadata["fluence"] = exp_params["fluence"]
+    metadata["temperature"] = exp_params["temperature"]
+    metadata["exposure"] = exp_params["exposure"]
+    metadata["notes"] = exp_params["notes"]
+    metadata["pump_wavelength"] = exp_params["pump wavelength"]
+
+    metadata["scans"] = tuple(range(1, int(exp_params["nscans"]) + 1))
+    metadata["time_points"] = np.asarray(
+        literal_eval(exp_params["time points"]), dtype=np.float64
+    )
+    metadata["time_points"].setflags(write=False)
+
+    return metadata
+
+
 class McGillRawDatasetDelta(AbstractRawDataset):
     """
     Raw dataset from the Siwick Research Group Diffractometer, in use 
@@ -62,44 +141,64 @@ class McGillRawDatasetDelta(AbstractRawDataset):
 
         metadata_dict = self.parse_metadata(os.path.join(source , "metadata.cfg"))
         super().__init__(source, metadata_dict)
+        self._abs_source = source
+
+        # scan directories look like 'scan_0132'
+        self._scan_dirs = {
+            scan: os.path.join(self._abs_source, f"scan_{scan:04d}") for scan in self.scans
+        }
 
         # Key-value stores where keys are always fileos.abspaths, and values are always floats
-        self.timestamps = csv_to_kvstore(self.source , "timestamps.csv")
+        self.timestamps = csv_to_kvstore(self._abs_source , "timestamps.csv")
         #print(f"Source is {self.source}")
         #self.timestamps.__getitem__ = newgetitem
-        self.ecounts = csv_to_kvstore(self.source , "ecounts.csv")
-        self.room_temperature = csv_to_kvstore(self.source , "room_temp.csv")
-        self.room_humidity = csv_to_kvstore(self.source , "room_humidity.csv")
+        self.ecounts = csv_to_kvstore(self._abs_source , "ecounts.csv")
+        self.room_temperature = csv_to_kvstore(self._abs_source , "room_temp.csv")
+        self.room_humidity = csv_to_kvstore(self._abs_source , "room_humidity.csv")
+
+        # Electron counts of pump-on images, indexed by (scan - 1, time-point index)
+        # Missing images are marked by NaN
+        self._tp_index = {timedelay: j for j, timedelay in enumerate(self.time_points)}
+        self._ecount_arr = np.full((len(self.scans), len(self.time_points)), np.nan)
+        for i, scan in enumerate(self.scans):
+            for j, timedelay in enumerate(self.time_points):
+                fname = os.path.join(self._scan_dirs[scan], f"pumpon_{timedelay:+010.3f}ps.tif")
+                with suppress(KeyError):
+                    self._ecount_arr[i, j] = self.ecounts.values[self.ecounts.index[fname]]
+
+        # Filenames and timestamps of background images, partitioned and sorted
+        # once so that the nearest image can be found with a binary search
+        self._categories = {
+            category: self._partition_timestamps(category)
+            for category in (LASER_BACKGROUND, PUMP_OFF, DARK_IMAGE)
+        }
+
+    def _partition_timestamps(self, category):
+        """ 
+        Filenames and timestamps of all images whose path contains ``category``, 
+        sorted by timestamp. 
+        """
+        mask = np.char.find(self.timestamps.names, category) >= 0
+        names, timestamps = self.timestamps.names[mask], self.timestamps.values[mask]
+        order = np.argsort(timestamps, kind="stable")
+        return names[order], timestamps[order]
+
+    def _resolve_nearest(self, category, timestamp):
+        """ Filename of the image in ``category`` taken nearest to ``timestamp`` """
+        names, timestamps = self._categories[category]
+        return str(names[int(nearest_index(timestamps, timestamp))])
 
     def nearest_laserbg(self, timestamp):
-        """ Laser background taken nearest to ``timestamp`` """
-        fnames = {
-            abs(v) - timestamp: k
-            for (k, v) in self.timestamps.items() if "laser_background" in k
-            #if k.parent == os.path.abspath("laser_background")
-        }
-        nearest_timestamp = min(fnames.keys())
-        return diffread(os.path.join(self.source , fnames[nearest_timestamp]))
+        """ Laser background taken nearest to ``timestamp``, as a read-only array """
+        return cached_read(self._resolve_nearest(LASER_BACKGROUND, timestamp))
 
     def nearest_pumpoff(self, timestamp):
-        """ pumpoff image taken nearest to ``timestamp`` """
-        fnames = {
-            abs(v) - timestamp: k
-            for (k, v) in self.timestamps.items() if "pump_off" in k
-            #if k.parent == os.path.abspath("pump_off")
-        }
-        nearest_timestamp = min(fnames.keys())
-        return diffread(os.path.join(self.source , fnames[nearest_timestamp]))
+        """ pumpoff image taken nearest to ``timestamp``, as a read-only array """
+        return cached_read(self._resolve_nearest(PUMP_OFF, timestamp))
 
     def nearest_dark(self, timestamp):
-        """ Dark image taken nearest to ``timestamp`` """
-        fnames = {
-            abs(v) - timestamp: k
-            for (k, v) in self.timestamps.items() if "dark_image" in k
-            #if k.parent == os.path.abspath("dark_image")
-        }
-        nearest_timestamp = min(fnames.keys())
-        return diffread(os.path.join(self.source , fnames[nearest_timestamp]))
+        """ Dark image taken nearest to ``timestamp``, as a read-only array """
+        return cached_read(self._resolve_nearest(DARK_IMAGE, timestamp))
 
     def parse_metadata(self, fname):
         """ 
@@ -110,25 +209,9 @@ class McGillRawDatasetDelta(AbstractRawDataset):
         fname : str or os.path.abspath-like
             Filename to the config file.
         """
-        metadata = dict()
-
-        parser = ConfigParser(inline_comment_prefixes=("#"))
-        parser.read(fname)
-        exp_params = parser["EXPERIMENTAL PARAMETERS"]
-
-        # Translation is required between metadata formats
-        metadata["energy"] = exp_params["electron energy"]
-        metadata["acquisition_date"] = exp_params["acquisition date"]
-        metadata["fluence"] = exp_params["fluence"]
-        metadata["temperature"] = exp_params["temperature"]
-        metadata["exposure"] = exp_params["exposure"]
-        metadata["notes"] = exp_params["notes"]
-        metadata["pump_wavelength"] = exp_params["pump wavelength"]
-
-        metadata["scans"] = list(range(1, int(exp_params["nscans"]) + 1))
-        metadata["time_points"] = eval(exp_params["time points"])
-
-        return metadata
+        fname = os.path.abspath(fname)
+        # The cached dictionary is shared, hence the copy
+        return dict(read_metadata(fname, os.path.getmtime(fname)))
 
     @check_raw_bounds
     def electron_count(self, timedelay, scan):
@@ -153,16 +236,17 @@ class McGillRawDatasetDelta(AbstractRawDataset):
         ValueError : if ``timedelay`` or ``scan`` are invalid / out of bounds.
         IOError : Filename is not associated with an image/does not exist.
         """
-        fname = (
-            os.path.join(os.path.abspath(self.source) , f"scan_{scan:04d}" , f"pumpon_{timedelay:+010.3f}ps.tif")
-        )
-        if not fname.exists():
+        try:
+            count = self._ecount_arr[scan - 1, self._tp_index[timedelay]]
+        except (IndexError, KeyError):
+            count = np.nan
+
+        if np.isnan(count):
             raise IOError(
                 f"Expected the file for {timedelay}ps and scan {scan} to exist, but could not find it."
             )
-        return self.ecounts[img_fname.relative_to(self.source)]
+        return float(count)
 
-    @asfarray
     @check_raw_bounds
     def raw_data(self, timedelay, scan=1, bgr=True, **kwargs):
         """
@@ -189,7 +273,7 @@ class McGillRawDatasetDelta(AbstractRawDataset):
         ValueError : if ``timedelay`` or ``scan`` are invalid / out of bounds.
         IOError : Filename is not associated with an image/does not exist.
         """
-        fname = os.path.join(os.path.abspath(self.source) , f"scan_{scan:04d}" , f"pumpon_{timedelay:+010.3f}ps.tif")
+        fname = os.path.join(self._scan_dirs[scan], f"pumpon_{timedelay:+010.3f}ps.tif")
         
 
         if not os.path.exists(fname):
@@ -197,12 +281,12 @@ class McGillRawDatasetDelta(AbstractRawDataset):
                 f"Expected the file for {timedelay}ps and scan {scan} to exist, but could not find it."
             )
 
-        im = diffread(fname)
+        im = np.array(read_mapped(fname), dtype=np.float32)
         if bgr:
             laser_bg = self.nearest_laserbg(
-                timestamp=self.timestamps[fname]#fname.relative_to(self.source)
+                timestamp=self.timestamps.values[self.timestamps.index[fname]]
             )
-            im -= laser_bg
+            np.subtract(im, laser_bg, out=im)
 
         return im
 
@@ -228,15 +312,10 @@ class McGillRawDatasetDeltaPumpoff(McGillRawDatasetDelta):
         super().__init__(*args, **kwargs)
         self.scans = [1]
 
-        # Determine time-stamps from filenames
-        fnames = {
-            k for (k, v) in self.timestamps.items() if "pump_off" in k
-        }
-        self.time_points = np.asfarray(
-            sorted(self.timestamps[fname] for fname in fnames)
-        )
+        # Time-points are the time-stamps of pump-off images
+        _, timestamps = self._categories[PUMP_OFF]
+        self.time_points = np.sort(timestamps)
 
-    @asfarray
     @check_raw_bounds
     def raw_data(self, timedelay, scan=1, bgr=True, **kwargs):
         """
@@ -264,18 +343,18 @@ class McGillRawDatasetDeltaPumpoff(McGillRawDatasetDelta):
         IOError : Filename is not associated with an image/does not exist.
         """
         # In this case, the time-delay is the pump-off timestamp
-        fname = os.path.join(self.source , "pump_off" , f"pump_off_epoch_{timedelay:010.0f}s.tif")
+        fname = os.path.join(self._abs_source , PUMP_OFF , f"pump_off_epoch_{timedelay:010.0f}s.tif")
 
-        if not fname.exists():
+        if not os.path.exists(fname):
             raise IOError(
                 f"Expected the file for {timedelay}ps and scan {scan} to exist, but could not find it."
             )
 
-        im = diffread(fname)
+        im = np.array(read_mapped(fname), dtype=np.float32)
         if bgr:
             dark_bg = self.nearest_dark(
-                timestamp=self.timestamps[fname]#.relative_to(self.source)]
+                timestamp=self.timestamps.values[self.timestamps.index[fname]]
             )
-            im -= dark_bg
+            np.subtract(im, dark_bg, out=im)
 
         return im